@@ -10,7 +10,7 @@ CREATE TABLE IF NOT EXISTS students (
     student_id VARCHAR(50) UNIQUE NOT NULL,
     name VARCHAR(100) NOT NULL,
     email VARCHAR(100) NOT NULL,
-    face_encoding LONGTEXT NOT NULL,
+    face_encoding VARBINARY(512) NOT NULL,
     photo_path VARCHAR(500) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
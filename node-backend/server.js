@@ -135,6 +135,20 @@ const uploadImage = multer({
     }
 });
 
+// Delete an uploaded file; a file that is already gone is not an error.
+// Unlinking directly avoids the existsSync()/unlinkSync() race.
+function removeUploadedFile(filePath) {
+    try {
+        fs.unlinkSync(filePath);
+        return true;
+    } catch (error) {
+        if (error.code !== 'ENOENT') {
+            throw error;
+        }
+        return false;
+    }
+}
+
 // JWT middleware
 const authenticateToken = (req, res, next) => {
     const authHeader = req.headers['authorization'];
@@ -372,19 +386,19 @@ app.post('/api/students/with-photo', authenticateToken, uploadImage.single('phot
                 [student_id, name, email, '', photoPath]
             );
 
-            // Call Python script to process the face encoding
-            const { spawn } = require('child_process');
-            const pythonScript = path.join(__dirname, '..', 'python-camera-system', 'register_student.py');
-            
-            const pythonProcess = spawn('python', [pythonScript, student_id, name, email, photoPath]);
-            
-            pythonProcess.on('close', (code) => {
-                if (code === 0) {
-                    console.log(`Face encoding processed successfully for student ${student_id}`);
-                } else {
-                    console.error(`Face encoding failed for student ${student_id}, code: ${code}`);
-                }
-            });
+            // Process the face encoding in the persistent registration worker; a worker
+            // that hangs for 60 seconds is killed and respawned for the next upload
+            registrationWorker.submit({ student_id, name, email, photo_path: photoPath }, null, 60000)
+                .then((result) => {
+                    if (result.success) {
+                        console.log(`Face encoding processed successfully for student ${student_id}`);
+                    } else {
+                        console.error(`Face encoding failed for student ${student_id}`);
+                    }
+                })
+                .catch((workerError) => {
+                    console.error(`Face encoding failed for student ${student_id}: ${workerError.message}`);
+                });
 
             connection.release();
             
@@ -397,9 +411,7 @@ app.post('/api/students/with-photo', authenticateToken, uploadImage.single('phot
         } catch (dbError) {
             connection.release();
             // Clean up uploaded file if database insert fails
-            if (fs.existsSync(photoPath)) {
-                fs.unlinkSync(photoPath);
-            }
+            removeUploadedFile(photoPath);
             throw dbError;
         }
 
@@ -447,10 +459,11 @@ app.delete('/api/students/:studentId', authenticateToken, async (req, res) => {
         connection.release();
 
         // Delete photo file if it exists
-        if (photoPath && fs.existsSync(photoPath)) {
+        if (photoPath) {
             try {
-                fs.unlinkSync(photoPath);
-                console.log(`Deleted photo file: ${photoPath}`);
+                if (removeUploadedFile(photoPath)) {
+                    console.log(`Deleted photo file: ${photoPath}`);
+                }
             } catch (fileError) {
                 console.error(`Failed to delete photo file: ${fileError.message}`);
             }
@@ -593,7 +606,7 @@ app.post('/api/upload/timetable', authenticateToken, upload.single('timetable'),
         connection.release();
 
         // Delete uploaded file
-        fs.unlinkSync(req.file.path);
+        removeUploadedFile(req.file.path);
 
         res.json({
             success: true,
@@ -944,105 +957,193 @@ app.get('/api/system/logs', authenticateToken, async (req, res) => {
         res.status(500).json({ error: 'Failed to fetch system logs' });
     }
 });
-// Frame processing endpoint for web terminals
-app.post('/api/process-frame', async (req, res) => {
-    try {
-        const { image, class_id, terminal_id } = req.body;
-        
-        if (!image || !class_id || !terminal_id) {
-            return res.status(400).json({ error: 'Missing required parameters' });
+// Persistent Python workers (`<script> --serve`): each keeps its face models and
+// database connections loaded between jobs. Jobs are JSON lines on stdin, optionally
+// followed by raw bytes; results come back as JSON lines tagged with the job_id.
+// A worker that exits is respawned on the next job; one that stops answering
+// within a job's timeout is killed.
+function createPythonWorker(scriptName, label) {
+    let worker = null;
+    let nextJobId = 0;
+    const pendingJobs = new Map();
+
+    // Reject the jobs that were sent to a worker that is gone
+    function failJobs(child, error) {
+        pendingJobs.forEach((job, jobId) => {
+            if (job.child === child) {
+                pendingJobs.delete(jobId);
+                clearTimeout(job.timeoutId);
+                job.reject(error);
+            }
+        });
+    }
+
+    function retire(child, error) {
+        if (worker === child) {
+            worker = null;
         }
+        failJobs(child, error);
+    }
 
-        // Convert base64 image to file
-        const base64Data = image.replace(/^data:image\/[a-z]+;base64,/, '');
-        const imageBuffer = Buffer.from(base64Data, 'base64');
-        const tempImagePath = path.join(__dirname, 'temp', `frame_${terminal_id}_${Date.now()}.jpg`);
-        
-        // Ensure temp directory exists
-        const tempDir = path.dirname(tempImagePath);
-        if (!fs.existsSync(tempDir)) {
-            fs.mkdirSync(tempDir, { recursive: true });
+    function getWorker() {
+        if (worker) {
+            return worker;
         }
-        
-        fs.writeFileSync(tempImagePath, imageBuffer);
 
-        // Process frame with Python face recognition
-        const pythonScript = path.join(__dirname, '..', 'python-camera-system', 'process_web_frame.py');
-        const pythonProcess = spawn('python', [pythonScript, tempImagePath, class_id, terminal_id]);
+        const pythonScript = path.join(__dirname, '..', 'python-camera-system', scriptName);
+        const child = spawn('python', [pythonScript, '--serve']);
+        child.lastOutputAt = Date.now();
+        let stdoutBuffer = '';
+
+        child.stdout.on('data', (data) => {
+            child.lastOutputAt = Date.now();
+            stdoutBuffer += data.toString();
+            let newlineIndex;
+            while ((newlineIndex = stdoutBuffer.indexOf('\n')) !== -1) {
+                const line = stdoutBuffer.slice(0, newlineIndex).trim();
+                stdoutBuffer = stdoutBuffer.slice(newlineIndex + 1);
+                if (!line) {
+                    continue;
+                }
 
-        let output = '';
-        let errorOutput = '';
-        let responseCompleted = false;
+                try {
+                    const result = JSON.parse(line);
+                    if (result.job_id == null) {
+                        // The worker could not read the job header, so it cannot say
+                        // which job this is; fail the oldest one sent to this worker
+                        // rather than leave it waiting for the timeout
+                        const oldest = [...pendingJobs].find(([, job]) => job.child === child);
+                        if (oldest) {
+                            const [jobId, job] = oldest;
+                            pendingJobs.delete(jobId);
+                            clearTimeout(job.timeoutId);
+                            job.reject(new Error(result.error || `${label} reply without a job_id`));
+                        }
+                        continue;
+                    }
 
-        pythonProcess.stdout.on('data', (data) => {
-            output += data.toString();
+                    const job = pendingJobs.get(result.job_id);
+                    if (job) {
+                        pendingJobs.delete(result.job_id);
+                        clearTimeout(job.timeoutId);
+                        delete result.job_id;
+                        job.resolve(result);
+                    }
+                } catch (parseError) {
+                    console.error(`Error parsing ${label} output:`, parseError);
+                }
+            }
         });
 
-        pythonProcess.stderr.on('data', (data) => {
-            errorOutput += data.toString();
+        child.stderr.on('data', (data) => {
+            console.error(`${label}:`, data.toString().trim());
         });
 
-        pythonProcess.on('close', (code) => {
-            // Clean up temp file
-            if (fs.existsSync(tempImagePath)) {
-                fs.unlinkSync(tempImagePath);
-            }
+        // Spawn failures and writes racing the worker's exit (EPIPE) must not
+        // become unhandled 'error' events that take down the server
+        child.on('error', (error) => {
+            console.error(`${label} error:`, error.message);
+            retire(child, new Error(`${label} failed: ${error.message}`));
+        });
 
-            // Check if response was already sent
-            if (res.headersSent || responseCompleted) {
-                return;
-            }
-            
-            responseCompleted = true;
-            clearTimeout(timeoutId);
+        child.stdin.on('error', (error) => {
+            console.error(`${label} stdin error:`, error.message);
+        });
 
-            if (code === 0) {
-                try {
-                    const result = JSON.parse(output);
-                    
-                    // Broadcast to WebSocket clients if attendance was marked
-                    if (result.attendance_marked && result.attendance_marked.length > 0) {
-                        result.attendance_marked.forEach(attendance => {
-                            broadcast({
-                                type: 'attendance_marked',
-                                student_name: attendance.student_name,
-                                student_id: attendance.student_id,
-                                class_id: class_id,
-                                terminal_id: terminal_id,
-                                timestamp: new Date().toISOString()
-                            });
-                        });
-                    }
-                    
-                    res.json(result);
-                } catch (parseError) {
-                    console.error('Error parsing Python output:', parseError);
-                    res.status(500).json({ error: 'Failed to process frame' });
-                }
-            } else {
-                console.error('Python process error:', errorOutput);
-                res.status(500).json({ error: 'Face recognition processing failed' });
-            }
+        child.on('close', (code) => {
+            console.error(`${label} exited with code ${code}`);
+            retire(child, new Error(`${label} exited`));
         });
 
-        // Timeout after 10 seconds
-        const timeoutId = setTimeout(() => {
-            // Check if response was already sent
-            if (res.headersSent || responseCompleted) {
-                return;
+        worker = child;
+        return child;
+    }
+
+    function submit(job, payload, timeoutMs) {
+        return new Promise((resolve, reject) => {
+            const jobId = String(++nextJobId);
+            const child = getWorker();
+            const submittedAt = Date.now();
+            const entry = { resolve, reject, child };
+
+            if (timeoutMs) {
+                entry.timeoutId = setTimeout(() => {
+                    pendingJobs.delete(jobId);
+                    const timeoutError = new Error(`${label} timeout`);
+                    timeoutError.code = 'ETIMEDOUT';
+                    reject(timeoutError);
+
+                    // No output at all since this job was sent: the worker is wedged
+                    if (child.lastOutputAt < submittedAt && child.exitCode === null) {
+                        console.error(`${label} unresponsive, restarting`);
+                        retire(child, new Error(`${label} restarted`));
+                        child.kill();
+                    }
+                }, timeoutMs);
             }
-            
-            responseCompleted = true;
-            pythonProcess.kill();
-            if (fs.existsSync(tempImagePath)) {
-                fs.unlinkSync(tempImagePath);
+
+            pendingJobs.set(jobId, entry);
+            child.stdin.write(JSON.stringify({ job_id: jobId, ...job }) + '\n');
+            if (payload) {
+                child.stdin.write(payload);
             }
-            res.status(500).json({ error: 'Frame processing timeout' });
-        }, 10000);
+        });
+    }
+
+    return { submit };
+}
+
+const frameWorker = createPythonWorker('process_web_frame.py', 'Frame worker');
+const registrationWorker = createPythonWorker('register_student.py', 'Registration worker');
+
+// The image bytes follow the JSON header directly
+function submitFrameJob(imageBuffer, classId, terminalId, timeoutMs) {
+    return frameWorker.submit({
+        length: imageBuffer.length,
+        class_id: classId,
+        terminal_id: terminalId
+    }, imageBuffer, timeoutMs);
+}
+
+// Frame processing endpoint for web terminals
+app.post('/api/process-frame', async (req, res) => {
+    try {
+        const { image, class_id, terminal_id } = req.body;
+        
+        if (!image || !class_id || !terminal_id) {
+            return res.status(400).json({ error: 'Missing required parameters' });
+        }
+
+        // Decode base64 image; the bytes are piped to the worker without a temp file
+        const base64Data = image.replace(/^data:image\/[a-z]+;base64,/, '');
+        const imageBuffer = Buffer.from(base64Data, 'base64');
+
+        // Process frame with the persistent Python face recognition worker,
+        // timing out after 10 seconds
+        const result = await submitFrameJob(imageBuffer, class_id, terminal_id, 10000);
+
+        // Broadcast to WebSocket clients if attendance was marked
+        if (result.attendance_marked && result.attendance_marked.length > 0) {
+            result.attendance_marked.forEach(attendance => {
+                broadcast({
+                    type: 'attendance_marked',
+                    student_name: attendance.student_name,
+                    student_id: attendance.student_id,
+                    class_id: class_id,
+                    terminal_id: terminal_id,
+                    timestamp: new Date().toISOString()
+                });
+            });
+        }
+        
+        res.json(result);
 
     } catch (error) {
         console.error('Frame processing error:', error);
-        res.status(500).json({ error: 'Failed to process frame' });
+        if (!res.headersSent) {
+            const message = error.code === 'ETIMEDOUT' ? 'Frame processing timeout' : 'Failed to process frame';
+            res.status(500).json({ error: message });
+        }
     }
 });
 
@@ -0,0 +1,310 @@
+"""
+Shared face matching helpers for the attendance system
+Used by both the camera system and the web frame processor
+"""
+
+import os
+from collections import OrderedDict
+
+import cv2
+import dlib
+import face_recognition_models
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Maximum euclidean distance between two encodings to count as the same person
+MATCH_TOLERANCE = 0.6
+
+# Face encodings are stored as 128 little-endian float32 values (512 bytes)
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.dtype('<f4')
+ENCODING_BLOB_SIZE = ENCODING_SIZE * ENCODING_DTYPE.itemsize
+
+# ...or quantized to 128 int8 codes (128 bytes) with a fixed scale; dlib
+# encoding values stay well inside +-0.3
+QUANTIZED_DTYPE = np.dtype('i1')
+QUANTIZED_BLOB_SIZE = ENCODING_SIZE * QUANTIZED_DTYPE.itemsize
+QUANTIZATION_RANGE = 0.3
+QUANTIZATION_SCALE = QUANTIZATION_RANGE / 127
+
+# Galleries smaller than this are matched with the Numba kernel instead of BLAS
+NUMBA_GALLERY_LIMIT = 64
+
+# Squared distance (0.4^2) under which a recent match is accepted without a full scan
+DECISIVE_SQ_DISTANCE = 0.16
+RECENT_MATCHES_CAPACITY = 16
+
+# dlib landmark and encoder models, loaded on first use by dlib_face_models()
+_dlib_face_models = None
+
+# Default location of the YuNet ONNX model, next to these scripts
+DEFAULT_YUNET_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'face_detection_yunet_2023mar.onnx')
+
+
+def decode_encoding(value):
+    """Decode a face encoding stored in the students table.
+
+    Binary float32 blobs are read with a single np.frombuffer call and int8
+    blobs are dequantized back to float32. Rows saved in the old
+    comma-separated text format are still parsed until
+    migrate_face_encodings.py has converted them.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) == ENCODING_BLOB_SIZE:
+            return np.frombuffer(value, dtype=ENCODING_DTYPE)
+        if len(value) == QUANTIZED_BLOB_SIZE:
+            return np.frombuffer(value, dtype=QUANTIZED_DTYPE).astype(np.float32) * np.float32(QUANTIZATION_SCALE)
+    
+    # Legacy comma-separated text
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('ascii')
+    return np.array(value.strip().split(','), dtype=ENCODING_DTYPE)
+
+
+def encoding_to_blob(face_encoding, quantize=True):
+    """Serialize a face encoding for the students table: 128 int8 codes, or 512 bytes of float32"""
+    if not quantize:
+        return np.ascontiguousarray(face_encoding, dtype=ENCODING_DTYPE).tobytes()
+    
+    codes = np.rint(np.clip(np.asarray(face_encoding, dtype=np.float32) / QUANTIZATION_SCALE, -127, 127))
+    return codes.astype(QUANTIZED_DTYPE).tobytes()
+
+
+def build_gallery(encodings):
+    """Build the contiguous float32 gallery matrix and its squared row norms"""
+    known_matrix = np.ascontiguousarray(np.array(encodings, dtype=np.float32).reshape(-1, 128))
+    known_sq_norms = np.einsum('ij,ij->i', known_matrix, known_matrix)
+    return known_matrix, known_sq_norms
+
+
+if NUMBA_AVAILABLE:
+    @njit('Tuple((i8, f4))(f4[:, ::1], f4[::1], f4[::1])', fastmath=True, cache=True)
+    def nearest_encoding(known, known_sq_norms, query):
+        """Return (index, squared distance) of the known encoding closest to query.
+        
+        Only used below NUMBA_GALLERY_LIMIT rows, so it runs serially rather than
+        waking a thread pool per call. The encoding length is a compile-time
+        constant, so the inner loop is unrolled and vectorized; one kernel serves
+        every gallery size. ||k||^2 - 2 k.q is enough for the argmin, and ||q||^2
+        is added at the end.
+        """
+        if known.shape[0] == 0:
+            return -1, np.float32(np.inf)
+        
+        # Seeded from row 0: fastmath lets LLVM assume no infinities
+        best = 0
+        best_score = np.float32(0.0)
+        query_sq = np.float32(0.0)
+        for j in range(ENCODING_SIZE):
+            query_sq += query[j] * query[j]
+        for i in range(known.shape[0]):
+            dot = np.float32(0.0)
+            for j in range(ENCODING_SIZE):
+                dot += known[i, j] * query[j]
+            score = known_sq_norms[i] - np.float32(2.0) * dot
+            if i == 0 or score < best_score:
+                best_score = score
+                best = i
+        return best, max(best_score + query_sq, np.float32(0.0))
+
+class RecentMatches:
+    """Small LRU of recently matched gallery indices, tried before a full scan"""
+    
+    def __init__(self, capacity=RECENT_MATCHES_CAPACITY):
+        self.capacity = capacity
+        self.indices = OrderedDict()
+    
+    def touch(self, index):
+        self.indices[index] = True
+        self.indices.move_to_end(index)
+        if len(self.indices) > self.capacity:
+            self.indices.popitem(last=False)
+    
+    def clear(self):
+        self.indices.clear()
+    
+    def __len__(self):
+        return len(self.indices)
+    
+    def __iter__(self):
+        return iter(self.indices)
+
+
+def _scan_gallery(known_matrix, known_sq_norms, queries):
+    """Return the nearest gallery index and squared distance for each query"""
+    # Small galleries: a fused JIT distance + argmin beats BLAS call overhead
+    if NUMBA_AVAILABLE and len(known_matrix) < NUMBA_GALLERY_LIMIT:
+        best = np.empty(len(queries), dtype=np.int64)
+        best_sq = np.empty(len(queries), dtype=np.float32)
+        for k, query in enumerate(queries):
+            best[k], best_sq[k] = nearest_encoding(known_matrix, known_sq_norms, query)
+        return best, best_sq
+    
+    query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+
+    # (N, K) scores: one column per detected face
+    scores = known_matrix @ queries.T
+    sq_dists = known_sq_norms[:, None] - 2.0 * scores + query_sq_norms[None, :]
+
+    best = np.argmin(sq_dists, axis=0)
+    best_sq = np.maximum(sq_dists[best, np.arange(len(queries))], 0.0)
+    return best, best_sq
+
+
+def match_encodings(known_matrix, known_sq_norms, face_encodings, tolerance=MATCH_TOLERANCE, recent=None):
+    """Match a batch of face encodings against the gallery in a single GEMM.
+
+    Uses ||k - q||^2 = ||k||^2 - 2 k.q + ||q||^2 so one matrix product scores
+    every detected face against every known face. When a RecentMatches LRU
+    is given, recently seen students are scored first and faces with a
+    decisive match among them skip the full gallery scan. Returns a list with
+    one (best_index, distance) tuple per encoding; best_index is -1 when the
+    closest known face is not within tolerance.
+    """
+    if len(face_encodings) == 0 or len(known_matrix) == 0:
+        return [(-1, float('inf'))] * len(face_encodings)
+
+    queries = np.ascontiguousarray(np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128))
+    best = np.full(len(queries), -1, dtype=np.int64)
+    best_sq = np.full(len(queries), np.inf, dtype=np.float32)
+    
+    # Fast path: recently matched students only
+    recent_indices = np.fromiter(recent or (), dtype=np.int64)
+    recent_indices = recent_indices[recent_indices < len(known_matrix)]
+    if len(recent_indices) > 0:
+        recent_best, recent_sq = _scan_gallery(
+            np.ascontiguousarray(known_matrix[recent_indices]), known_sq_norms[recent_indices], queries
+        )
+        decisive = recent_sq < DECISIVE_SQ_DISTANCE
+        best[decisive] = recent_indices[recent_best[decisive]]
+        best_sq[decisive] = recent_sq[decisive]
+    
+    # Full scan for every face without a decisive recent match
+    pending = best < 0
+    if pending.any():
+        best[pending], best_sq[pending] = _scan_gallery(
+            known_matrix, known_sq_norms, np.ascontiguousarray(queries[pending])
+        )
+
+    results = []
+    for index, sq_dist in zip(best, best_sq):
+        distance = float(np.sqrt(sq_dist))
+        if sq_dist < tolerance * tolerance:
+            results.append((int(index), distance))
+            if recent is not None:
+                recent.touch(int(index))
+        else:
+            results.append((-1, distance))
+    return results
+
+
+def create_face_detector(model_path, input_size=(160, 120), score_threshold=0.6):
+    """Create an OpenCV YuNet face detector, or None if it is unavailable"""
+    if not model_path or not os.path.exists(model_path) or not hasattr(cv2, 'FaceDetectorYN'):
+        return None
+    return cv2.FaceDetectorYN.create(model_path, '', input_size, score_threshold=score_threshold)
+
+
+def detect_face_locations(detector, bgr_image):
+    """Run the YuNet detector and return dlib-style (top, right, bottom, left) boxes"""
+    height, width = bgr_image.shape[:2]
+    detector.setInputSize((width, height))
+    _, detections = detector.detect(bgr_image)
+
+    if detections is None:
+        return []
+
+    face_locations = []
+    for x, y, w, h in detections[:, :4]:
+        left = max(int(x), 0)
+        top = max(int(y), 0)
+        right = min(int(x + w), width)
+        bottom = min(int(y + h), height)
+        if right > left and bottom > top:
+            face_locations.append((top, right, bottom, left))
+    return face_locations
+
+
+def dlib_face_models():
+    """Return dlib's (5-point shape predictor, face encoder), loaded once per process"""
+    global _dlib_face_models
+    if _dlib_face_models is None:
+        # face_recognition's default (model="small"); stored encodings were made with it
+        _dlib_face_models = (
+            dlib.shape_predictor(face_recognition_models.pose_predictor_five_point_model_location()),
+            dlib.face_recognition_model_v1(face_recognition_models.face_recognition_model_location())
+        )
+    return _dlib_face_models
+
+
+def rects_to_locations(rects, image_shape):
+    """Convert dlib rectangles to (top, right, bottom, left) boxes clipped to the image"""
+    height, width = image_shape[:2]
+    face_locations = []
+    for rect in rects:
+        top, right = max(rect.top(), 0), min(rect.right(), width)
+        bottom, left = min(rect.bottom(), height), max(rect.left(), 0)
+        if right > left and bottom > top:
+            face_locations.append((top, right, bottom, left))
+    return face_locations
+
+
+def detect_gray_face_locations(hog_detector, gray_image, upsample=1):
+    """Run dlib's HOG detector on a grayscale image and return (top, right, bottom, left) boxes.
+    
+    HOG only uses luminance, so this skips the full-frame BGR to RGB conversion
+    that face_recognition.face_locations needs.
+    """
+    return rects_to_locations(hog_detector(gray_image, upsample), gray_image.shape)
+
+
+def encode_face_crops(bgr_image, face_locations, scale=1):
+    """Encode faces from crops around each box; only the crops are converted to RGB.
+    
+    Boxes are multiplied by scale first, for detections made on a downsampled frame.
+    Calls dlib's landmark predictor and encoder directly, one descriptor per box.
+    """
+    shape_predictor, face_encoder = dlib_face_models()
+    height, width = bgr_image.shape[:2]
+    face_encodings = []
+    
+    for top, right, bottom, left in face_locations:
+        # Scale the box up and add a margin so the landmarks stay inside the crop
+        top, right, bottom, left = top * scale, right * scale, bottom * scale, left * scale
+        margin = (bottom - top) // 4
+        y0, y1 = max(top - margin, 0), min(bottom + margin, height)
+        x0, x1 = max(left - margin, 0), min(right + margin, width)
+        
+        roi = cv2.cvtColor(bgr_image[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        shape = shape_predictor(roi, dlib.rectangle(left - x0, top - y0, right - x0, bottom - y0))
+        face_encodings.append(np.array(face_encoder.compute_face_descriptor(roi, shape, 1)))
+    
+    return face_encodings
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def dedupe_face_locations(face_locations, iou_threshold=0.5):
+    """Drop boxes that overlap an earlier box by more than iou_threshold"""
+    kept = []
+    for location in face_locations:
+        if all(box_iou(location, other) <= iou_threshold for other in kept):
+            kept.append(location)
+    return kept
+
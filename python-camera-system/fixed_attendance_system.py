@@ -1,26 +1,62 @@
 import os
 import cv2
 import face_recognition
+import dlib
 import numpy as np
-import mysql.connector
+from mysql.connector import pooling
+from contextlib import closing
 from datetime import datetime, timedelta
+from collections import deque
 import threading
 import time
 import logging
 from dotenv import load_dotenv
 
+from face_utils import (
+    build_gallery, decode_encoding, match_encodings, create_face_detector,
+    detect_face_locations, detect_gray_face_locations, encode_face_crops,
+    RecentMatches, DEFAULT_YUNET_MODEL
+)
+
 load_dotenv()
 
+# Queued attendance marks are written to the database this often (seconds)
+ATTENDANCE_FLUSH_SECONDS = 1.0
+
+# Expired absent toggle entries are purged after this many processed frames
+ABSENT_TOGGLE_PURGE_FRAMES = 300
+
 class FixedAttendanceSystem:
     def __init__(self):
+        self.db_pool = None
         self.setup_logging()
+        self.check_dlib_build()
+        self.setup_face_detector()
+        self.setup_batch_detection()
         self.setup_database()
         self.load_valid_faces()
         self.current_class = None
         self.class_start_time = None
         self.absent_toggle_timer = {}
         self.camera = None
-        self.system_active = False
+        self.stop_event = threading.Event()
+        self.workers_active = threading.Event()
+        self.capture_thread = None
+        self.recognition_thread = None
+        self.latest_frame = None
+        self.frame_ready = threading.Event()
+        self.latest_result = (None, None)
+        self.result_lock = threading.Lock()
+        self.motion_threshold = float(os.getenv('MOTION_THRESHOLD', 2.5))
+        self.small_frame = None
+        self.motion_refresh_seconds = float(os.getenv('MOTION_REFRESH_SECONDS', 1.0))
+        self.gray_buffers = []
+        self.key_gray = None
+        self.last_detection_at = 0.0
+        self.last_detections = []
+        self.pending_attendance = {}
+        self.pending_lock = threading.Lock()
+        self.last_flush = time.monotonic()
         
     def setup_logging(self):
         """Setup comprehensive logging"""
@@ -35,44 +71,102 @@ class FixedAttendanceSystem:
         self.logger = logging.getLogger(__name__)
         self.logger.info("=== Fixed Attendance System Starting ===")
     
+    def check_dlib_build(self):
+        """Warn loudly if dlib was built without SIMD acceleration"""
+        if getattr(dlib, 'USE_AVX_INSTRUCTIONS', False):
+            self.logger.info("dlib built with AVX instructions")
+            return True
+        
+        self.logger.warning("!" * 60)
+        self.logger.warning("dlib was built WITHOUT AVX instructions - face detection and encoding")
+        self.logger.warning("will be several times slower. Rebuild it with ./setup_dlib.sh")
+        self.logger.warning("!" * 60)
+        return False
+    
+    def setup_face_detector(self):
+        """Setup the YuNet DNN face detector, falling back to dlib HOG"""
+        self.hog_detector = dlib.get_frontal_face_detector()
+        model_path = os.getenv('YUNET_MODEL_PATH', DEFAULT_YUNET_MODEL)
+        try:
+            self.face_detector = create_face_detector(model_path)
+        except Exception as e:
+            self.logger.warning(f"Failed to load YuNet face detector: {e}")
+            self.face_detector = None
+        
+        if self.face_detector is not None:
+            self.logger.info(f"Using YuNet face detector ({model_path})")
+        else:
+            self.logger.warning(f"YuNet model not available at {model_path} - falling back to dlib HOG detector")
+    
+    def setup_batch_detection(self):
+        """Enable batched CNN face detection when dlib can run it on CUDA"""
+        self.detection_batch_size = int(os.getenv('DETECTION_BATCH_SIZE', 8))
+        self.frame_queue = deque(maxlen=self.detection_batch_size)
+        self.frame_lock = threading.Lock()
+        
+        use_cnn = os.getenv('FACE_DETECTION_MODEL', 'hog').lower() == 'cnn'
+        self.use_cuda_batching = use_cnn and getattr(dlib, 'DLIB_USE_CUDA', False)
+        
+        if self.use_cuda_batching:
+            self.logger.info(f"Using batched CNN face detection on CUDA (batch size {self.detection_batch_size})")
+        elif use_cnn:
+            self.logger.warning("FACE_DETECTION_MODEL=cnn but dlib was built without CUDA - using CPU detection")
+    
     def setup_database(self):
-        """Setup database connection with error handling"""
+        """Setup database connection pool with error handling"""
         try:
-            self.db_connection = mysql.connector.connect(
-                host=os.getenv('DB_HOST'),
-                user=os.getenv('DB_USER'),
-                password=os.getenv('DB_PASSWORD'),
-                database=os.getenv('DB_NAME'),
-                auth_plugin='mysql_native_password'
-            )
-            self.cursor = self.db_connection.cursor()
+            if self.db_pool is None:
+                # The main loop and the recognition thread each take their own connection
+                self.db_pool = pooling.MySQLConnectionPool(
+                    pool_name='attendance_system',
+                    pool_size=int(os.getenv('DB_POOL_SIZE', 8)),
+                    host=os.getenv('DB_HOST'),
+                    user=os.getenv('DB_USER'),
+                    password=os.getenv('DB_PASSWORD'),
+                    database=os.getenv('DB_NAME'),
+                    auth_plugin='mysql_native_password'
+                )
+            
+            # Make sure the server is reachable
+            with self.get_db_connection() as connection:
+                connection.ping(reconnect=True)
             self.logger.info("Database connection established successfully")
             return True
         except Exception as e:
             self.logger.error(f"Database connection failed: {e}")
             return False
     
+    def get_db_connection(self):
+        """Borrow a pooled connection; closing it returns it to the pool"""
+        return closing(self.db_pool.get_connection())
+    
     def load_valid_faces(self):
         """Load only valid face encodings from database"""
+        self.known_matrix, self.known_sq_norms = build_gallery([])
+        # Gallery indices change on reload
+        self.recent_matches = RecentMatches()
         try:
-            self.cursor.execute("SELECT student_id, name, face_encoding FROM students")
-            students = self.cursor.fetchall()
+            with self.get_db_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT student_id, name, face_encoding FROM students")
+                students = cursor.fetchall()
+                cursor.close()
             
-            self.known_face_encodings = []
+            known_face_encodings = []
             self.known_face_names = []
             self.known_face_ids = []
             
             valid_count = 0
             invalid_count = 0
             
-            for student_id, name, encoding_str in students:
+            for student_id, name, encoding_value in students:
                 try:
-                    # Convert string back to numpy array
-                    encoding = np.fromstring(encoding_str, sep=',')
+                    # Convert stored blob back to numpy array
+                    encoding = decode_encoding(encoding_value)
                     
                     # Only accept 128-dimensional encodings
                     if encoding.shape[0] == 128:
-                        self.known_face_encodings.append(encoding)
+                        known_face_encodings.append(encoding)
                         self.known_face_names.append(name)
                         self.known_face_ids.append(student_id)
                         valid_count += 1
@@ -88,10 +182,11 @@ class FixedAttendanceSystem:
             self.logger.info(f"Face encoding summary: {valid_count} valid, {invalid_count} invalid")
             
             if valid_count > 0:
-                # Test if we can create a numpy array from valid encodings
+                # Keep the gallery as one contiguous float32 (N, 128) matrix so
+                # every frame can be matched against it without rebuilding it
                 try:
-                    test_array = np.array(self.known_face_encodings)
-                    self.logger.info(f"Face encodings array shape: {test_array.shape}")
+                    self.known_matrix, self.known_sq_norms = build_gallery(known_face_encodings)
+                    self.logger.info(f"Face encodings array shape: {self.known_matrix.shape}")
                     return True
                 except Exception as e:
                     self.logger.error(f"Error creating face encodings array: {e}")
@@ -118,8 +213,11 @@ class FixedAttendanceSystem:
             LIMIT 1
             """
             
-            self.cursor.execute(query, (current_date, current_time, current_time))
-            result = self.cursor.fetchone()
+            with self.get_db_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(query, (current_date, current_time, current_time))
+                result = cursor.fetchone()
+                cursor.close()
             
             if result:
                 class_id, class_name, start_time, end_time = result
@@ -176,137 +274,296 @@ class FixedAttendanceSystem:
             self.logger.error(f"Camera initialization failed: {e}")
             return False
     
-    def process_frame(self):
-        """Process camera frame for face detection and recognition"""
-        if not self.camera or not self.camera.isOpened():
-            return None, None
+    def prepare_buffers(self, frame):
+        """(Re)allocate the downsampled frame buffers when the frame size changes"""
+        height, width = frame.shape[:2]
+        small_shape = (height // 4, width // 4)
         
-        ret, frame = self.camera.read()
-        if not ret or frame is None:
-            return None, None
+        if self.small_frame is None or self.small_frame.shape[:2] != small_shape:
+            self.small_frame = np.empty(small_shape + (3,), dtype=np.uint8)
+            # Two grayscale buffers: the keyframe of the last detection, and the current frame
+            self.gray_buffers = [np.empty(small_shape, dtype=np.uint8) for _ in range(2)]
+            self.key_gray = None
+    
+    def process_frame(self, frame):
+        """Detect and recognize faces in a single camera frame"""
+        self.prepare_buffers(frame)
+        small_frame = self.small_frame
         
-        # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+        # Resize frame for faster processing, straight into the preallocated buffer
+        cv2.resize(frame, (small_frame.shape[1], small_frame.shape[0]), dst=small_frame, interpolation=cv2.INTER_AREA)
         
-        detected_students = []
+        # Skip detection when the scene has not changed since the last detected frame.
+        # Comparing against that keyframe, not the previous frame, lets slow motion
+        # accumulate, and a periodic refresh bounds how stale the result can get
+        gray = self.gray_buffers[1] if self.key_gray is self.gray_buffers[0] else self.gray_buffers[0]
+        cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        now = time.monotonic()
+        if (self.key_gray is not None
+                and now - self.last_detection_at < self.motion_refresh_seconds
+                and cv2.absdiff(gray, self.key_gray).mean() < self.motion_threshold):
+            return self.last_detections
+        self.key_gray = gray
+        self.last_detection_at = now
         
         try:
             # Find faces in the frame
-            face_locations = face_recognition.face_locations(rgb_small_frame)
+            if self.face_detector is not None:
+                face_locations = detect_face_locations(self.face_detector, small_frame)
+            else:
+                # HOG only needs luminance; reuse the motion-gate grayscale frame
+                face_locations = detect_gray_face_locations(self.hog_detector, gray)
+        except Exception as e:
+            self.logger.error(f"Frame processing error: {e}")
+            return []
+        
+        self.last_detections = self.recognize_faces(frame, face_locations)
+        return self.last_detections
+    
+    def process_frame_batch(self, frames):
+        """Detect faces in a batch of frames with dlib's CNN model on the GPU"""
+        rgb_small_frames = [
+            cv2.cvtColor(cv2.resize(frame, (0, 0), fx=0.25, fy=0.25), cv2.COLOR_BGR2RGB)
+            for frame in frames
+        ]
+        
+        try:
+            batch_locations = face_recognition.batch_face_locations(
+                rgb_small_frames, number_of_times_to_upsample=1, batch_size=len(rgb_small_frames)
+            )
+        except Exception as e:
+            self.logger.error(f"Batch frame processing error: {e}")
+            return [[] for _ in frames]
+        
+        return [
+            self.recognize_faces(frame, face_locations)
+            for frame, face_locations in zip(frames, batch_locations)
+        ]
+    
+    def encode_faces(self, frame, face_locations):
+        """Encode faces from full-resolution crops around the small-frame detections"""
+        return encode_face_crops(frame, face_locations, scale=4)
+    
+    def recognize_faces(self, frame, face_locations):
+        """Encode detected faces and match them against known students"""
+        detected_students = []
+        
+        if len(face_locations) > 0:
+            self.logger.debug(f"Found {len(face_locations)} faces in frame")
             
-            if len(face_locations) > 0:
-                self.logger.debug(f"Found {len(face_locations)} faces in frame")
+            # Get face encodings with error handling
+            try:
+                face_encodings = self.encode_faces(frame, face_locations)
                 
-                # Get face encodings with error handling
-                try:
-                    face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-                    
-                    # Only proceed if we have valid known faces
-                    if len(self.known_face_encodings) > 0:
-                        # Compare with known faces
-                        for i, face_encoding in enumerate(face_encodings):
-                            try:
-                                matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding, tolerance=0.6)
-                                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                                
-                                if len(face_distances) > 0:
-                                    best_match_index = np.argmin(face_distances)
-                                    
-                                    if matches[best_match_index] and face_distances[best_match_index] < 0.6:
-                                        student_id = self.known_face_ids[best_match_index]
-                                        student_name = self.known_face_names[best_match_index]
-                                        confidence = 1 - face_distances[best_match_index]
-                                        
-                                        detected_students.append({
-                                            'id': student_id,
-                                            'name': student_name,
-                                            'confidence': confidence,
-                                            'location': face_locations[i]
-                                        })
-                                        
-                                        self.logger.info(f"🎯 RECOGNIZED: {student_name} ({student_id}) - Confidence: {confidence:.2f}")
-                            except Exception as e:
-                                self.logger.warning(f"Face comparison error: {e}")
-                    else:
-                        self.logger.warning("No valid known faces loaded for comparison")
+                # Only proceed if we have valid known faces
+                if len(self.known_matrix) > 0:
+                    # Compare all faces in the frame with known faces in one pass
+                    try:
+                        matches = match_encodings(
+                            self.known_matrix, self.known_sq_norms, face_encodings, recent=self.recent_matches
+                        )
                         
-                except Exception as e:
-                    self.logger.warning(f"Face encoding error: {e}")
+                        for i, (best_match_index, distance) in enumerate(matches):
+                            if best_match_index >= 0:
+                                student_id = self.known_face_ids[best_match_index]
+                                student_name = self.known_face_names[best_match_index]
+                                confidence = 1 - distance
+                                
+                                detected_students.append({
+                                    'id': student_id,
+                                    'name': student_name,
+                                    'confidence': confidence,
+                                    'location': face_locations[i]
+                                })
+                                
+                                self.logger.info(f"🎯 RECOGNIZED: {student_name} ({student_id}) - Confidence: {confidence:.2f}")
+                    except Exception as e:
+                        self.logger.warning(f"Face comparison error: {e}")
+                else:
+                    self.logger.warning("No valid known faces loaded for comparison")
+                    
+            except Exception as e:
+                self.logger.warning(f"Face encoding error: {e}")
         
-        except Exception as e:
-            self.logger.error(f"Frame processing error: {e}")
+        return detected_students
+    
+    def start_workers(self):
+        """Start the camera capture and face recognition threads"""
+        self.frame_queue.clear()
+        self.latest_frame = None
+        self.latest_result = (None, None)
+        self.key_gray = None
+        self.last_detections = []
+        self.frame_ready.clear()
+        self.workers_active.set()
         
-        return detected_students, frame
+        self.capture_thread = threading.Thread(target=self._capture_frames, daemon=True)
+        self.recognition_thread = threading.Thread(target=self._recognize_frames, daemon=True)
+        self.capture_thread.start()
+        self.recognition_thread.start()
+    
+    def stop_workers(self):
+        """Stop the worker threads before the camera is released"""
+        self.workers_active.clear()
+        for thread in (self.capture_thread, self.recognition_thread):
+            if thread:
+                thread.join(timeout=2)
+        self.capture_thread = None
+        self.recognition_thread = None
+        self.flush_attendance(force=True)
+        self.frame_queue.clear()
+        self.latest_frame = None
+    
+    def _capture_frames(self):
+        """Capture thread: keep only the newest camera frame(s) buffered"""
+        while self.workers_active.is_set() and self.camera and self.camera.isOpened():
+            ret, frame = self.camera.read()
+            if not ret or frame is None:
+                continue
+            
+            with self.frame_lock:
+                self.latest_frame = frame
+                if self.use_cuda_batching:
+                    self.frame_queue.append(frame)
+            self.frame_ready.set()
+    
+    def _recognize_frames(self):
+        """Recognition thread: process the freshest frame and mark attendance"""
+        frames_processed = 0
+        while self.workers_active.is_set():
+            self.flush_attendance()
+            if not self.frame_ready.wait(timeout=0.1):
+                continue
+            self.frame_ready.clear()
+            
+            try:
+                if self.use_cuda_batching:
+                    frames = self.take_frame_batch()
+                    if not frames:
+                        continue
+                    results = list(zip(self.process_frame_batch(frames), frames))
+                else:
+                    # Swap the buffer out so the capture thread can fill a fresh one
+                    with self.frame_lock:
+                        frame, self.latest_frame = self.latest_frame, None
+                    if frame is None:
+                        continue
+                    results = [(self.process_frame(frame), frame)]
+                
+                # Mark attendance for detected students
+                for detected_students, frame in results:
+                    for student in detected_students:
+                        self.mark_attendance(student['id'], 'present')
+                        self.handle_absent_toggle(student['id'])
+                
+                with self.result_lock:
+                    self.latest_result = results[-1]
+                
+                frames_processed += len(results)
+                if frames_processed >= ABSENT_TOGGLE_PURGE_FRAMES:
+                    frames_processed = 0
+                    self.purge_absent_toggle_timers()
+            except Exception as e:
+                self.logger.error(f"Error in recognition thread: {e}")
+    
+    def take_latest_result(self):
+        """Return the newest (detected_students, frame) result once"""
+        with self.result_lock:
+            result = self.latest_result
+            self.latest_result = (None, None)
+        return result
+    
+    def take_frame_batch(self):
+        """Return a full batch of queued frames, or an empty list if not ready"""
+        with self.frame_lock:
+            if len(self.frame_queue) < self.detection_batch_size:
+                return []
+            batch = list(self.frame_queue)
+            self.frame_queue.clear()
+        return batch
     
     def mark_attendance(self, student_id, status='present'):
-        """Mark attendance for a student with comprehensive logging"""
-        if not self.current_class:
+        """Queue an attendance mark; queued marks are written by flush_attendance"""
+        current_class = self.current_class
+        if not current_class:
             self.logger.warning("No active class - cannot mark attendance")
             return False
         
+        # Repeated detections of the same student collapse into the newest mark
+        with self.pending_lock:
+            self.pending_attendance[(student_id, current_class['id'])] = (status, datetime.now(), current_class['name'])
+        return True
+    
+    def flush_attendance(self, force=False):
+        """Write queued attendance marks in one transaction, at most once a second"""
+        if not force and time.monotonic() - self.last_flush < ATTENDANCE_FLUSH_SECONDS:
+            return True
+        self.last_flush = time.monotonic()
+        
+        with self.pending_lock:
+            pending = self.pending_attendance
+            self.pending_attendance = {}
+        if not pending:
+            return True
+        
+        attendance_rows = []
+        activity_rows = []
+        for (student_id, class_id), (status, marked_at, class_name) in pending.items():
+            attendance_rows.append((student_id, class_id, status, marked_at))
+            activity_rows.append((f"Student {student_id} marked {status} for class {class_name} at {marked_at}",))
+        
         try:
-            current_time = datetime.now()
-            
-            # Check if attendance already exists for this class
-            check_query = """
-            SELECT id, status, marked_at FROM attendance
-            WHERE student_id = %s AND class_id = %s
-            ORDER BY marked_at DESC LIMIT 1
-            """
-            self.cursor.execute(check_query, (student_id, self.current_class['id']))
-            existing = self.cursor.fetchone()
-            
-            if existing:
-                # Update existing attendance
-                update_query = """
-                UPDATE attendance SET status = %s, marked_at = %s
-                WHERE id = %s
-                """
-                self.cursor.execute(update_query, (status, current_time, existing[0]))
-                self.logger.info(f"📝 UPDATED: {student_id} attendance changed from {existing[1]} to {status}")
-            else:
-                # Insert new attendance record
-                insert_query = """
-                INSERT INTO attendance (student_id, class_id, status, marked_at)
-                VALUES (%s, %s, %s, %s)
-                """
-                self.cursor.execute(insert_query, (student_id, self.current_class['id'], status, current_time))
-                self.logger.info(f"📝 NEW RECORD: {student_id} marked as {status} at {current_time}")
-            
-            self.db_connection.commit()
-            
-            # Log activity
-            activity = f"Student {student_id} marked {status} for class {self.current_class['name']} at {current_time}"
-            self.log_activity(activity)
+            with self.get_db_connection() as connection:
+                cursor = connection.cursor()
+                # UNIQUE(student_id, class_id) lets the server do the insert-or-update
+                cursor.executemany("""
+                    INSERT INTO attendance (student_id, class_id, status, marked_at)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE status = VALUES(status), marked_at = VALUES(marked_at)
+                """, attendance_rows)
+                cursor.executemany("INSERT INTO activity_logs (activity) VALUES (%s)", activity_rows)
+                connection.commit()
+                cursor.close()
             
+            for student_id, _, status, marked_at in attendance_rows:
+                self.logger.info(f"📝 MARKED: {student_id} as {status} at {marked_at}")
             return True
         except Exception as e:
-            self.logger.error(f"Error marking attendance for {student_id}: {e}")
+            self.logger.error(f"Error writing {len(attendance_rows)} attendance records: {e}")
+            
+            # Requeue for the next flush unless a newer mark has arrived
+            with self.pending_lock:
+                for key, value in pending.items():
+                    self.pending_attendance.setdefault(key, value)
             return False
     
     def log_activity(self, activity):
         """Log system activity to database"""
         try:
             query = "INSERT INTO activity_logs (activity) VALUES (%s)"
-            self.cursor.execute(query, (activity,))
-            self.db_connection.commit()
+            with self.get_db_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(query, (activity,))
+                connection.commit()
+                cursor.close()
         except Exception as e:
             self.logger.error(f"Error logging activity: {e}")
     
     def handle_absent_toggle(self, student_id, duration=3):
         """Handle absent toggle timer to prevent rapid status changes"""
-        def clear_timer():
-            time.sleep(duration)
-            if student_id in self.absent_toggle_timer:
-                del self.absent_toggle_timer[student_id]
-        
-        if student_id not in self.absent_toggle_timer:
-            self.absent_toggle_timer[student_id] = threading.Thread(target=clear_timer)
-            self.absent_toggle_timer[student_id].start()
+        now = time.monotonic()
+        if now >= self.absent_toggle_timer.get(student_id, 0):
+            self.absent_toggle_timer[student_id] = now + duration
             return True
         return False
     
+    def purge_absent_toggle_timers(self):
+        """Drop expired absent toggle entries so the dict stays bounded"""
+        now = time.monotonic()
+        self.absent_toggle_timer = {
+            student_id: expiry for student_id, expiry in self.absent_toggle_timer.items() if expiry > now
+        }
+    
     def draw_detection_info(self, frame, detected_students):
         """Draw detection information on frame"""
         if not detected_students:
@@ -331,14 +588,20 @@ class FixedAttendanceSystem:
         return frame
     
     def run_system(self):
-        """Main system loop with comprehensive error handling"""
-        self.system_active = True
+        """Main system loop: class scheduling and display (UI stays on this thread)"""
+        self.stop_event.clear()
         self.logger.info("Starting main attendance marking loop")
         
-        while self.system_active:
+        current_class = None
+        last_class_check = 0
+        screenshot_frame = None
+        
+        while not self.stop_event.is_set():
             try:
-                # Check for current class
-                current_class = self.get_current_class()
+                # Check for current class about once a second
+                if time.monotonic() - last_class_check >= 1:
+                    current_class = self.get_current_class()
+                    last_class_check = time.monotonic()
                 
                 if current_class:
                     # New class detected
@@ -348,30 +611,27 @@ class FixedAttendanceSystem:
                         self.log_activity(f"Class started: {current_class['name']}")
                         self.logger.info(f"*** CLASS STARTED: {current_class['name']} (ID: {current_class['id']}) ***")
                     
-                    # Initialize camera if needed
+                    # Initialize camera and start capture/recognition threads if needed
                     if not self.camera:
                         if not self.initialize_camera():
                             self.logger.error("Failed to initialize camera, waiting 5 seconds...")
-                            time.sleep(5)
+                            self.stop_event.wait(5)
                             continue
+                        self.start_workers()
                     
-                    # Process frame
-                    detected_students, frame = self.process_frame()
+                    # Show the newest recognition result
+                    detected_students, frame = self.take_latest_result()
                     
                     if frame is not None:
-                        # Mark attendance for detected students
-                        if detected_students:
-                            for student in detected_students:
-                                self.mark_attendance(student['id'], 'present')
-                                self.handle_absent_toggle(student['id'])
-                        
-                        # Draw detection info on frame
-                        display_frame = self.draw_detection_info(frame.copy(), detected_students)
+                        # Draw detection info directly on the frame; each result frame is
+                        # owned by this thread, and screenshots keep the overlay for auditing
+                        display_frame = self.draw_detection_info(frame, detected_students)
+                        screenshot_frame = display_frame
                         
                         # Add system info overlay
                         cv2.putText(display_frame, f"Class: {self.current_class['name']}", (10, 30), 
                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                        cv2.putText(display_frame, f"Known Students: {len(self.known_face_encodings)}", (10, 60), 
+                        cv2.putText(display_frame, f"Known Students: {len(self.known_face_ids)}", (10, 60), 
                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
                         cv2.putText(display_frame, f"Detected: {len(detected_students) if detected_students else 0}", (10, 90), 
                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
@@ -387,32 +647,33 @@ class FixedAttendanceSystem:
                     elif key == ord('s'):
                         # Save screenshot
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        if frame is not None:
-                            cv2.imwrite(f"attendance_screenshot_{timestamp}.jpg", frame)
+                        if screenshot_frame is not None:
+                            cv2.imwrite(f"attendance_screenshot_{timestamp}.jpg", screenshot_frame)
                             self.logger.info(f"Screenshot saved: attendance_screenshot_{timestamp}.jpg")
                 
                 else:
                     # No active class
                     if self.camera:
+                        self.stop_workers()
                         self.camera.release()
                         self.camera = None
                         cv2.destroyAllWindows()
                         self.current_class = None
+                        screenshot_frame = None
                         self.log_activity("Camera shut down - no active class")
                         self.logger.info("No active class - camera shut down")
                     
-                    time.sleep(10)  # Check for classes every 10 seconds
+                    self.stop_event.wait(10)  # Check for classes every 10 seconds
             
             except Exception as e:
                 self.logger.error(f"Error in main loop: {e}")
-                time.sleep(5)
+                self.stop_event.wait(5)
         
         # Cleanup
+        self.stop_workers()
         if self.camera:
             self.camera.release()
         cv2.destroyAllWindows()
-        if self.db_connection:
-            self.db_connection.close()
         self.logger.info("=== Fixed Attendance System Stopped ===")
     
     def start(self):
@@ -444,7 +705,7 @@ class FixedAttendanceSystem:
         except KeyboardInterrupt:
             self.logger.info("System interrupted by user")
         finally:
-            self.system_active = False
+            self.stop_event.set()
 
 if __name__ == "__main__":
     system = FixedAttendanceSystem()
@@ -0,0 +1,92 @@
+"""
+Face Encoding Migration Utility
+Converts face encodings stored as comma-separated text into binary
+blobs (128 int8 codes each). Run once after upgrading:
+
+    python migrate_face_encodings.py
+"""
+
+import os
+import sys
+import mysql.connector
+from dotenv import load_dotenv
+
+from face_utils import ENCODING_BLOB_SIZE, ENCODING_SIZE, QUANTIZED_BLOB_SIZE, decode_encoding, encoding_to_blob
+
+load_dotenv()
+
+def connect_to_database():
+    """Connect to the MySQL database"""
+    try:
+        connection = mysql.connector.connect(
+            host=os.getenv('DB_HOST'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            database=os.getenv('DB_NAME')
+        )
+        return connection
+    except Exception as e:
+        print(f"Error connecting to database: {e}")
+        return None
+
+def migrate_encodings():
+    """Rewrite every text face encoding as a binary blob"""
+    connection = connect_to_database()
+    if not connection:
+        return False
+    
+    try:
+        cursor = connection.cursor()
+        
+        # Switch the column to a binary type first; existing text is kept as bytes.
+        # BLOB still fits the long text rows, VARBINARY(512) is set once they are converted
+        cursor.execute("ALTER TABLE students MODIFY face_encoding BLOB NOT NULL")
+        
+        cursor.execute("SELECT student_id, face_encoding FROM students")
+        students = cursor.fetchall()
+        
+        updates = []
+        skipped = 0
+        for student_id, value in students:
+            if not value or len(value) in (ENCODING_BLOB_SIZE, QUANTIZED_BLOB_SIZE):
+                continue
+            
+            try:
+                encoding = decode_encoding(value)
+            except (ValueError, UnicodeDecodeError) as e:
+                print(f"❌ Skipped {student_id}: could not parse encoding ({e})")
+                skipped += 1
+                continue
+            
+            if encoding.shape[0] != ENCODING_SIZE:
+                print(f"❌ Skipped {student_id}: invalid encoding shape {encoding.shape}")
+                skipped += 1
+                continue
+            
+            updates.append((encoding_to_blob(encoding), student_id))
+        
+        if updates:
+            cursor.executemany(
+                "UPDATE students SET face_encoding = %s WHERE student_id = %s",
+                updates
+            )
+            connection.commit()
+        
+        print(f"✅ Migrated {len(updates)} face encodings ({skipped} skipped)")
+        
+        if skipped:
+            print("⚠️ Column left as BLOB; fix or re-register the skipped students and run again")
+        else:
+            cursor.execute(f"ALTER TABLE students MODIFY face_encoding VARBINARY({ENCODING_BLOB_SIZE}) NOT NULL")
+            print(f"✅ face_encoding column is now VARBINARY({ENCODING_BLOB_SIZE})")
+        return True
+        
+    except Exception as e:
+        print(f"Error migrating face encodings: {e}")
+        return False
+    
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate_encodings() else 1)
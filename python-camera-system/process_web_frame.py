@@ -4,17 +4,33 @@ Web Frame Processing Script for Attendance System
 Processes camera frames sent from web terminals
 """
 
+import os
+
+# One BLAS/OpenMP thread per process: --serve already runs one worker process per core
+for _var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_var, '1')
+
 import sys
 import json
 import cv2
 import numpy as np
-import face_recognition
-import mysql.connector
+import dlib
+from mysql.connector import pooling
 from datetime import datetime
-import os
 import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from contextlib import closing
 from dotenv import load_dotenv
 
+from face_utils import (
+    build_gallery, decode_encoding, match_encodings, create_face_detector,
+    detect_face_locations, detect_gray_face_locations, dedupe_face_locations,
+    encode_face_crops, RecentMatches, DEFAULT_YUNET_MODEL
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -22,6 +38,43 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Face detectors for this process, loaded by init_worker()
+_face_detector = None
+_hog_detector = None
+
+# Images larger than a 720p terminal frame are split into this many stripes for
+# parallel HOG detection; neighbouring stripes overlap by the largest face expected
+STRIPE_COUNT = 2
+STRIPE_MIN_PIXELS = 1280 * 720
+STRIPE_MAX_FACE = int(os.getenv('STRIPE_MAX_FACE', 400))
+
+# dlib detectors keep mutable scan buffers, so each stripe thread gets its own.
+# The stripe threads are kept between frames so their detectors are reused.
+_stripe_detectors = threading.local()
+_stripe_pool = None
+
+# How often (seconds) the worker checks whether the students table changed
+GALLERY_REFRESH_SECONDS = 60
+
+# Database connection pool and face gallery kept between frames
+_pool = None
+_pool_lock = threading.Lock()
+_gallery_lock = threading.Lock()
+_gallery = None
+_gallery_version = None
+_gallery_checked_at = 0
+_recent_matches = RecentMatches()
+
+ATTENDANCE_EXISTS_SQL = """
+    SELECT id FROM attendance 
+    WHERE student_id = %s AND class_id = %s
+"""
+
+ATTENDANCE_INSERT_SQL = """
+    INSERT INTO attendance (student_id, class_id, status, marked_at, terminal_id)
+    VALUES (%s, %s, 'present', NOW(), %s)
+"""
+
 def load_database_config():
     """Load database configuration from environment or defaults"""
     return {
@@ -32,75 +85,108 @@ def load_database_config():
         'port': int(os.getenv('DB_PORT', 3306))
     }
 
+def load_face_detector():
+    """Load the YuNet face detector if its model file is available"""
+    model_path = os.getenv('YUNET_MODEL_PATH', DEFAULT_YUNET_MODEL)
+    try:
+        return create_face_detector(model_path)
+    except Exception as e:
+        logger.warning(f"Failed to load YuNet face detector: {e}")
+        return None
+
+def get_connection():
+    """Borrow a pooled database connection; closing it returns it to the pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(
+                pool_name='web_frames',
+                pool_size=int(os.getenv('DB_POOL_SIZE', 8)),
+                **load_database_config()
+            )
+    return closing(_pool.get_connection())
+
+def get_known_faces():
+    """Return the cached face gallery, reloading it when the students table changes"""
+    global _gallery, _gallery_version, _gallery_checked_at
+    
+    with _gallery_lock:
+        if _gallery is not None and time.time() - _gallery_checked_at < GALLERY_REFRESH_SECONDS:
+            return _gallery
+        
+        try:
+            with get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM students")
+                version = cursor.fetchone()
+                cursor.close()
+        except Exception as e:
+            logger.error(f"Error checking students table: {e}")
+            version = None
+        
+        if _gallery is None or version is None or version != _gallery_version:
+            _gallery = load_known_faces()
+            _gallery_version = version
+            # Gallery indices change on reload
+            _recent_matches.clear()
+        _gallery_checked_at = time.time()
+        return _gallery
+
 def load_known_faces():
     """Load known face encodings from database"""
     try:
-        db_config = load_database_config()
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT student_id, name, face_encoding 
-            FROM students 
-            WHERE face_encoding IS NOT NULL AND face_encoding != ''
-        """)
+        with get_connection() as connection:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT student_id, name, face_encoding 
+                FROM students 
+                WHERE face_encoding IS NOT NULL AND face_encoding != ''
+            """)
+            students = cursor.fetchall()
+            cursor.close()
         
-        students = cursor.fetchall()
         known_encodings = []
         known_names = []
         known_ids = []
         
         for student in students:
             try:
-                # Parse face encoding from comma-separated string
-                encoding_str = student['face_encoding'].strip()
-                if encoding_str:
-                    encoding_list = [float(x) for x in encoding_str.split(',')]
-                    if len(encoding_list) == 128:  # Valid face encoding
-                        known_encodings.append(np.array(encoding_list))
-                        known_names.append(student['name'])
-                        known_ids.append(student['student_id'])
-            except (ValueError, TypeError) as e:
+                # Decode the stored float32 face encoding
+                encoding = decode_encoding(student['face_encoding'])
+                if encoding.shape[0] == 128:  # Valid face encoding
+                    known_encodings.append(encoding)
+                    known_names.append(student['name'])
+                    known_ids.append(student['student_id'])
+            except (ValueError, TypeError, UnicodeDecodeError) as e:
                 logger.warning(f"Invalid face encoding for student {student['student_id']}: {e}")
                 continue
         
-        cursor.close()
-        connection.close()
+        # Single contiguous float32 (N, 128) gallery matrix
+        known_matrix, known_sq_norms = build_gallery(known_encodings)
         
-        logger.info(f"Loaded {len(known_encodings)} valid face encodings")
-        return known_encodings, known_names, known_ids
+        logger.info(f"Loaded {len(known_ids)} valid face encodings")
+        return known_matrix, known_sq_norms, known_names, known_ids
         
     except Exception as e:
         logger.error(f"Error loading known faces: {e}")
-        return [], [], []
+        known_matrix, known_sq_norms = build_gallery([])
+        return known_matrix, known_sq_norms, [], []
 
 def mark_attendance(student_id, class_id, terminal_id):
     """Mark attendance for a student"""
     try:
-        db_config = load_database_config()
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        
-        # Check if attendance already exists for this class
-        cursor.execute("""
-            SELECT id FROM attendance 
-            WHERE student_id = %s AND class_id = %s
-        """, (student_id, class_id))
-        
-        if cursor.fetchone():
-            cursor.close()
-            connection.close()
-            return False  # Already marked
-        
-        # Mark attendance as present
-        cursor.execute("""
-            INSERT INTO attendance (student_id, class_id, status, marked_at, terminal_id)
-            VALUES (%s, %s, 'present', NOW(), %s)
-        """, (student_id, class_id, terminal_id))
-        
-        connection.commit()
-        cursor.close()
-        connection.close()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(ATTENDANCE_EXISTS_SQL, (student_id, class_id))
+                if cursor.fetchall():
+                    return False  # Already marked
+                
+                # Mark attendance as present
+                cursor.execute(ATTENDANCE_INSERT_SQL, (student_id, class_id, terminal_id))
+                connection.commit()
+            finally:
+                cursor.close()
         
         logger.info(f"Attendance marked for student {student_id} in class {class_id}")
         return True
@@ -109,78 +195,143 @@ def mark_attendance(student_id, class_id, terminal_id):
         logger.error(f"Error marking attendance: {e}")
         return False
 
-def process_frame(image_path, class_id, terminal_id):
+def init_worker():
+    """Load the face detectors once per worker process"""
+    global _face_detector, _hog_detector
+    # The pool supplies the parallelism; OpenCV's own thread pool would
+    # start another thread per core inside every worker
+    cv2.setNumThreads(1)
+    _face_detector = load_face_detector()
+    _hog_detector = dlib.get_frontal_face_detector()
+
+def stripe_detector():
+    """Return this thread's own HOG detector for stripe scanning"""
+    detector = getattr(_stripe_detectors, 'detector', None)
+    if detector is None:
+        detector = _stripe_detectors.detector = dlib.get_frontal_face_detector()
+    return detector
+
+def hog_face_locations(gray_image):
+    """Run dlib HOG detection, split into overlapping stripes for large images.
+    
+    dlib's HOG detector only uses one core, so images larger than a terminal
+    frame are cut into horizontal stripes that are scanned in parallel threads.
+    """
+    global _stripe_pool
+    height, width = gray_image.shape[:2]
+    if height * width <= STRIPE_MIN_PIXELS:
+        return detect_gray_face_locations(_hog_detector, gray_image)
+    
+    # Overlap the stripes so faces on a boundary are fully inside one of them
+    stripe_height = height // STRIPE_COUNT
+    pad = max(height // 6, STRIPE_MAX_FACE // 2)
+    stripes = [
+        (max(i * stripe_height - pad, 0), min((i + 1) * stripe_height + pad, height))
+        for i in range(STRIPE_COUNT)
+    ]
+    
+    def detect_stripe(stripe):
+        start, end = stripe
+        locations = detect_gray_face_locations(stripe_detector(), gray_image[start:end])
+        return [(top + start, right, bottom + start, left) for top, right, bottom, left in locations]
+    
+    if _stripe_pool is None:
+        _stripe_pool = ThreadPoolExecutor(max_workers=STRIPE_COUNT)
+    results = _stripe_pool.map(detect_stripe, stripes)
+    
+    return dedupe_face_locations([location for locations in results for location in locations])
+
+def load_image(source):
+    """Load a BGR image from a file path or from encoded JPEG/PNG bytes"""
+    if isinstance(source, (bytes, bytearray)):
+        # Decode in memory, no temp file round-trip
+        return cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(source)
+
+def read_image_bytes(stream, length):
+    """Read exactly length bytes of image data from a binary stream"""
+    data = stream.read(length)
+    if len(data) != length:
+        raise EOFError(f"Expected {length} image bytes, got {len(data)}")
+    return data
+
+def detect_and_encode(source):
+    """Detect and encode faces in an image; returns None if it cannot be loaded"""
+    # Load the image
+    image = load_image(source)
+    if image is None:
+        return None
+    
+    # Find faces in the image; HOG only needs luminance
+    if _face_detector is not None:
+        face_locations = detect_face_locations(_face_detector, image)
+    else:
+        face_locations = hog_face_locations(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    
+    # Only the face crops are converted to RGB for encoding
+    face_encodings = encode_face_crops(image, face_locations)
+    
+    return face_locations, face_encodings
+
+def process_frame(source, class_id, terminal_id):
     """Process a single frame for face recognition"""
     try:
-        # Load the image
-        image = cv2.imread(image_path)
-        if image is None:
+        detection = detect_and_encode(source)
+        if detection is None:
             logger.error("Could not load image")
             return {"error": "Could not load image"}
         
-        # Convert BGR to RGB
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Find faces in the image
-        face_locations = face_recognition.face_locations(rgb_image)
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        face_locations, face_encodings = detection
+        return recognize_faces(face_locations, face_encodings, class_id, terminal_id)
         
+    except Exception as e:
+        logger.error(f"Error processing frame: {e}")
+        return {"error": str(e)}
+
+def recognize_faces(face_locations, face_encodings, class_id, terminal_id):
+    """Match detected faces against known students and mark their attendance"""
+    try:
         if not face_locations:
             return {"faces": [], "attendance_marked": []}
         
-        # Load known faces
-        known_encodings, known_names, known_ids = load_known_faces()
+        # Known faces are cached between frames
+        known_matrix, known_sq_norms, known_names, known_ids = get_known_faces()
         
-        if not known_encodings:
+        if len(known_matrix) == 0:
             logger.warning("No known face encodings available")
             return {"faces": [], "attendance_marked": []}
         
         faces_data = []
         attendance_marked = []
         
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            # Compare with known faces
-            matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-            distances = face_recognition.face_distance(known_encodings, face_encoding)
-            
-            if len(distances) > 0:
-                best_match_index = np.argmin(distances)
+        # Compare all detected faces with known faces in one pass
+        matches = match_encodings(known_matrix, known_sq_norms, face_encodings, recent=_recent_matches)
+        
+        for (top, right, bottom, left), (best_match_index, distance) in zip(face_locations, matches):
+            if best_match_index >= 0:
+                # Recognized face
+                student_name = known_names[best_match_index]
+                student_id = known_ids[best_match_index]
+                
+                face_data = {
+                    "x": left,
+                    "y": top,
+                    "width": right - left,
+                    "height": bottom - top,
+                    "recognized": True,
+                    "name": student_name,
+                    "student_id": student_id,
+                    "confidence": 1 - distance
+                }
                 
-                if matches[best_match_index] and distances[best_match_index] < 0.6:
-                    # Recognized face
-                    student_name = known_names[best_match_index]
-                    student_id = known_ids[best_match_index]
-                    
-                    face_data = {
-                        "x": left,
-                        "y": top,
-                        "width": right - left,
-                        "height": bottom - top,
-                        "recognized": True,
-                        "name": student_name,
+                # Try to mark attendance
+                if mark_attendance(student_id, class_id, terminal_id):
+                    attendance_marked.append({
                         "student_id": student_id,
-                        "confidence": 1 - distances[best_match_index]
-                    }
-                    
-                    # Try to mark attendance
-                    if mark_attendance(student_id, class_id, terminal_id):
-                        attendance_marked.append({
-                            "student_id": student_id,
-                            "student_name": student_name
-                        })
-                else:
-                    # Unknown face
-                    face_data = {
-                        "x": left,
-                        "y": top,
-                        "width": right - left,
-                        "height": bottom - top,
-                        "recognized": False,
-                        "name": "Unknown",
-                        "confidence": 0
-                    }
+                        "student_name": student_name
+                    })
             else:
-                # No known encodings to compare
+                # Unknown face
                 face_data = {
                     "x": left,
                     "y": top,
@@ -203,17 +354,102 @@ def process_frame(image_path, class_id, terminal_id):
         logger.error(f"Error processing frame: {e}")
         return {"error": str(e)}
 
+def serve():
+    """Long-running worker mode.
+    
+    Reads one JSON job per line from stdin ({"job_id", "image_path", "class_id",
+    "terminal_id"}) and writes one JSON result per line to stdout, tagged with
+    the job_id. A job may send {"length": n} instead of "image_path"; the n raw
+    image bytes then follow the header line directly. Detection and encoding
+    run in a process pool, one worker per CPU core; matching and database
+    writes run on a single consumer thread in this process, so the pool's
+    dispatch thread never waits on the database and the gallery/recent-match
+    state is only touched by one thread.
+    """
+    executor = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=init_worker)
+    consumer = ThreadPoolExecutor(max_workers=1)
+    output_lock = threading.Lock()
+    
+    def finish_job(job, future):
+        try:
+            detection = future.result()
+            if detection is None:
+                logger.error("Could not load image")
+                result = {"error": "Could not load image"}
+            else:
+                face_locations, face_encodings = detection
+                result = recognize_faces(face_locations, face_encodings, job['class_id'], job['terminal_id'])
+        except Exception as e:
+            logger.error(f"Error processing frame: {e}")
+            result = {"error": str(e)}
+        
+        result["job_id"] = job.get("job_id")
+        with output_lock:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    
+    # Load the gallery once up front instead of on the first frame
+    get_known_faces()
+    logger.info(f"Frame processing worker started with {os.cpu_count()} processes")
+    
+    stdin = sys.stdin.buffer
+    try:
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            job = {}
+            try:
+                job = json.loads(line)
+                if 'length' in job:
+                    source = read_image_bytes(stdin, int(job['length']))
+                else:
+                    source = job['image_path']
+                future = executor.submit(detect_and_encode, source)
+            except EOFError as e:
+                logger.error(f"Truncated job input: {e}")
+                break
+            except (ValueError, KeyError, TypeError) as e:
+                # Echo the job_id whenever the header parsed, so the caller can match the reply
+                result = {"error": f"Invalid job: {e}"}
+                result["job_id"] = job.get("job_id") if isinstance(job, dict) else None
+                with output_lock:
+                    sys.stdout.write(json.dumps(result) + "\n")
+                    sys.stdout.flush()
+                continue
+            # Keep the callback trivial: it only hands the detection to the consumer
+            future.add_done_callback(partial(consumer.submit, finish_job, job))
+    finally:
+        executor.shutdown(wait=True)
+        consumer.shutdown(wait=True)
+
 def main():
     """Main function"""
+    if len(sys.argv) == 2 and sys.argv[1] == '--serve':
+        serve()
+        return
+    
     if len(sys.argv) != 4:
-        print(json.dumps({"error": "Usage: python process_web_frame.py <image_path> <class_id> <terminal_id>"}))
+        print(json.dumps({"error": "Usage: python process_web_frame.py <image_path|--stdin-binary> <class_id> <terminal_id> | --serve"}))
         sys.exit(1)
     
-    image_path = sys.argv[1]
+    init_worker()
+    
     class_id = sys.argv[2]
     terminal_id = sys.argv[3]
     
-    result = process_frame(image_path, class_id, terminal_id)
+    if sys.argv[1] == '--stdin-binary':
+        # Byte count on the first line, then the encoded image
+        try:
+            length = int(sys.stdin.buffer.readline())
+            source = read_image_bytes(sys.stdin.buffer, length)
+        except (ValueError, EOFError) as e:
+            print(json.dumps({"error": f"Invalid image input: {e}"}))
+            sys.exit(1)
+    else:
+        source = sys.argv[1]
+    
+    result = process_frame(source, class_id, terminal_id)
     print(json.dumps(result))
 
 if __name__ == "__main__":
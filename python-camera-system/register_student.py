@@ -5,148 +5,502 @@ Can be used for both camera capture and processing uploaded photos
 """
 
 import os
+
+# Cap BLAS/OpenMP threads before numpy and dlib load; a single-image
+# registration only oversubscribes the cores with one thread per core
+for _var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_var, '4')
+
 import sys
+import csv
+import json
 import cv2
-import face_recognition
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import dlib
+import face_recognition_models
 import mysql.connector
+from mysql.connector import pooling
 from dotenv import load_dotenv
 import numpy as np
+from PIL import Image
+
+from face_utils import (
+    build_gallery, decode_encoding, detect_gray_face_locations, encode_face_crops, encoding_to_blob,
+    match_encodings, rects_to_locations, ENCODING_SIZE
+)
 
 load_dotenv()
 
+# Large JPEGs are decoded at 1/2 or 1/4 scale as long as the longest side stays at least this
+PHOTO_MIN_SIDE = 960
+
+# Photos are downscaled so their longest side is at most this before face detection
+DETECTION_MAX_SIDE = 640
+
+# Photos per CNN forward pass in --batch mode
+PHOTO_BATCH_SIZE = int(os.getenv('PHOTO_BATCH_SIZE', '16'))
+
+# Rows per multi-row INSERT in --batch mode (keeps each statement well under max_allowed_packet)
+BULK_STATEMENT_SIZE = int(os.getenv('BULK_STATEMENT_SIZE', '500'))
+
+# Upsert used by --batch mode; executemany rewrites it into one multi-row INSERT per chunk
+BULK_UPSERT_SQL = """
+    INSERT INTO students (student_id, name, email, face_encoding)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+    name = VALUES(name),
+    email = VALUES(email),
+    face_encoding = VALUES(face_encoding)
+"""
+
+# Single-photo encoding update; the same string object is executed every time so the
+# prepared cursor in save_face_encoding() reuses its statement instead of re-preparing
+UPDATE_ENCODING_SQL = "UPDATE students SET face_encoding = %s WHERE student_id = %s"
+
+# A face closer than this to another student's encoding is rejected as a duplicate
+DUPLICATE_TOLERANCE = float(os.getenv('DUPLICATE_FACE_TOLERANCE', '0.4'))
+
+# Database connection pool, created on first use
+_pool = None
+
+# Connection outside the pool holding the prepared UPDATE for the life of the process;
+# a pooled connection's session is reset when it is returned, which drops the statement
+_writer_connection = None
+_update_statement = None
+
+# dlib face detectors; the CNN model is only loaded for GPU batch registration
+_hog_detector = dlib.get_frontal_face_detector()
+_cnn_detector = None
+
+def check_dlib_build():
+    """Report dlib acceleration; exit if CUDA is required but missing"""
+    if not getattr(dlib, 'USE_AVX_INSTRUCTIONS', False):
+        print("⚠️ dlib was built without AVX - face encoding will be slow. Rebuild with ./setup_dlib.sh")
+    
+    if not dlib.DLIB_USE_CUDA:
+        if os.getenv('REQUIRE_DLIB_CUDA', 'false').lower() == 'true':
+            print("❌ REQUIRE_DLIB_CUDA is set but dlib was built without CUDA. Rebuild with USE_CUDA=1 ./setup_dlib.sh")
+            sys.exit(1)
+        print("⚠️ dlib was built without CUDA - face encoding runs on the CPU")
+
+def database_config():
+    """Connection settings shared by the pool and the writer connection"""
+    return {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'database': os.getenv('DB_NAME'),
+        # Explicit pin: already the default in mysql-connector-python 8.1.0, kept so
+        # a newer default cannot silently switch back to the pure-Python protocol
+        'use_pure': False,
+    }
+
 def connect_to_database():
-    """Connect to the MySQL database"""
+    """Borrow a pooled connection to the MySQL database; close() returns it to the pool"""
+    global _pool
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
-        )
-        return connection
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(pool_name='register_student', pool_size=4, **database_config())
+        return _pool.get_connection()
     except Exception as e:
         print(f"Error connecting to database: {e}")
         return None
 
+def save_face_encoding(encoding_blob, student_id):
+    """Store one student's encoding through a prepared UPDATE kept open between calls.
+    
+    In --serve mode the statement is prepared once and every later registration
+    only sends COM_STMT_EXECUTE with the blob bound in binary. A failed execute
+    drops the connection so the next call reconnects and prepares again.
+    """
+    global _writer_connection, _update_statement
+    try:
+        if _update_statement is None:
+            _writer_connection = mysql.connector.connect(**database_config())
+            _update_statement = _writer_connection.cursor(prepared=True)
+        _update_statement.execute(UPDATE_ENCODING_SQL, (encoding_blob, student_id))
+        _writer_connection.commit()
+    except Exception:
+        if _writer_connection is not None:
+            try:
+                _writer_connection.close()
+            except Exception:
+                pass
+        _writer_connection = _update_statement = None
+        raise
+
+def load_registered_faces(connection, exclude_ids=()):
+    """Load the encodings of all other registered students as a gallery plus (student_id, name) pairs"""
+    cursor = connection.cursor()
+    cursor.execute("SELECT student_id, name, face_encoding FROM students WHERE face_encoding != ''")
+    rows = cursor.fetchall()
+    cursor.close()
+    
+    students = []
+    encodings = []
+    for student_id, name, value in rows:
+        if student_id in exclude_ids:
+            continue
+        try:
+            encoding = decode_encoding(value)
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if encoding.shape[0] == ENCODING_SIZE:
+            students.append((student_id, name))
+            encodings.append(encoding)
+    
+    return build_gallery(encodings), students
+
+def find_duplicate_faces(registered_faces, face_encodings):
+    """Return, per encoding, the (student_id, name, distance) of a registered look-alike or None.
+    
+    Distances are computed by the shared face_utils matcher (Numba for small
+    galleries, one GEMM for large ones).
+    """
+    (known_matrix, known_sq_norms), students = registered_faces
+    matches = match_encodings(known_matrix, known_sq_norms, face_encodings, tolerance=DUPLICATE_TOLERANCE)
+    return [students[index] + (distance,) if index >= 0 else None for index, distance in matches]
+
+def pairwise_sq_distances(face_encodings):
+    """Return the (n, n) matrix of squared distances between face encodings"""
+    matrix, sq_norms = build_gallery(face_encodings)
+    return np.maximum(sq_norms[:, None] - 2.0 * (matrix @ matrix.T) + sq_norms[None, :], 0.0)
+
+class RegisteredFacesPrefetch:
+    """Connect and load the registered faces on a background thread while photos are encoded.
+    
+    Use as a context manager; the connection is returned to the pool on exit.
+    """
+    
+    def __init__(self, exclude_ids=()):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.future = executor.submit(self._load, exclude_ids)
+        executor.shutdown(wait=False)
+    
+    @staticmethod
+    def _load(exclude_ids):
+        connection = connect_to_database()
+        if not connection:
+            return None, None
+        try:
+            return connection, load_registered_faces(connection, exclude_ids)
+        except Exception:
+            connection.close()
+            raise
+    
+    def result(self):
+        """Wait for (connection, registered_faces); connection is None if the database is unreachable"""
+        return self.future.result()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        try:
+            connection, _ = self.future.result()
+        except Exception:
+            return False
+        if connection:
+            connection.close()
+        return False
+
 def process_photo_file(photo_path, student_id, student_name, student_email):
     """Process an uploaded photo file to extract face encoding"""
     print(f"Processing photo for {student_name} ({student_id})")
     
     try:
-        # Load the image
-        image = cv2.imread(photo_path)
-        if image is None:
-            print(f"Error: Could not load image from {photo_path}")
-            return False
-        
-        # Convert BGR to RGB (face_recognition uses RGB)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Find face locations
-        face_locations = face_recognition.face_locations(rgb_image)
-        
-        if len(face_locations) == 0:
-            print("Error: No face found in the image")
-            return False
-        
-        if len(face_locations) > 1:
-            print("Warning: Multiple faces found, using the first one")
-        
-        # Extract face encoding
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        # The database work overlaps with detection and encoding
+        with RegisteredFacesPrefetch(exclude_ids=(student_id,)) as prefetch:
+            # Detect once and encode the first face
+            face_encoding = process_face_encoding(photo_path)
+            if face_encoding is None:
+                return False
+            
+            # Convert to a compact int8 blob for database storage
+            encoding_blob = encoding_to_blob(face_encoding)
+            
+            # Update database with face encoding
+            connection, registered_faces = prefetch.result()
+            if not connection:
+                return False
+            
+            try:
+                duplicate = find_duplicate_faces(registered_faces, [face_encoding])[0]
+                if duplicate:
+                    print(f"Error: Face already registered to {duplicate[1]} ({duplicate[0]}), distance {duplicate[2]:.2f}")
+                    return False
+                
+                # Update the student record with face encoding
+                save_face_encoding(encoding_blob, student_id)
+                
+                print(f"✅ Face encoding saved for {student_name}")
+                return True
+                
+            except Exception as e:
+                print(f"Error updating database: {e}")
+                return False
+            
+    except Exception as e:
+        print(f"Error processing photo: {e}")
+        return False
+
+def load_photo(photo_path):
+    """Decode a photo as BGR, letting libjpeg scale large images down during decoding"""
+    try:
+        # Only the header is read here
+        with Image.open(photo_path) as header:
+            longest = max(header.size)
+    except OSError:
+        longest = 0
+    
+    flag = cv2.IMREAD_COLOR
+    if longest // 4 >= PHOTO_MIN_SIDE:
+        flag = cv2.IMREAD_REDUCED_COLOR_4
+    elif longest // 2 >= PHOTO_MIN_SIDE:
+        flag = cv2.IMREAD_REDUCED_COLOR_2
+    
+    # Missing or empty files come back as None, like a corrupt image would
+    try:
+        return cv2.imdecode(np.fromfile(photo_path, dtype=np.uint8), flag)
+    except (OSError, cv2.error):
+        return None
+
+def downscale_for_detection(bgr_image):
+    """Return (small_image, scale) with the longest side at most DETECTION_MAX_SIDE"""
+    scale = min(DETECTION_MAX_SIDE / float(max(bgr_image.shape[:2])), 1.0)
+    if scale >= 1:
+        return bgr_image, scale
+    return cv2.resize(bgr_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+def upscale_locations(face_locations, scale):
+    """Map (top, right, bottom, left) boxes from a downscaled image back to full resolution"""
+    return [
+        (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+        for top, right, bottom, left in face_locations
+    ]
+
+def detect_faces(bgr_image):
+    """Find face locations on a downscaled copy, returned in full-resolution coordinates"""
+    small, scale = downscale_for_detection(bgr_image)
+    
+    # HOG only needs luminance
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return upscale_locations(detect_gray_face_locations(_hog_detector, gray), scale)
+
+def read_photo_manifest(manifest_path):
+    """Read (student_id, name, email, photo_path) rows from a CSV manifest"""
+    with open(manifest_path, newline='') as manifest:
+        rows = [tuple(field.strip() for field in row[:4]) for row in csv.reader(manifest) if len(row) >= 4]
+    
+    # Optional header row
+    if rows and rows[0][0] == 'student_id':
+        rows = rows[1:]
+    return rows
+
+def batch_face_locations(bgr_images):
+    """Detect faces in a list of images, batching same-sized images through the CNN on the GPU"""
+    global _cnn_detector
+    if not dlib.DLIB_USE_CUDA:
+        # The CNN is far too slow on the CPU; use HOG one image at a time
+        return [detect_faces(image) for image in bgr_images]
+    
+    if _cnn_detector is None:
+        _cnn_detector = dlib.cnn_face_detection_model_v1(face_recognition_models.cnn_face_detector_model_location())
+    
+    # The CNN needs RGB; swap channels with a straight copy of the reversed view
+    small_images = []
+    for image in bgr_images:
+        small, scale = downscale_for_detection(image)
+        small_images.append((np.ascontiguousarray(small[:, :, ::-1]), scale))
+    
+    # dlib can only batch images of identical size
+    groups = {}
+    for index, (small, _) in enumerate(small_images):
+        groups.setdefault(small.shape, []).append(index)
+    
+    locations = [None] * len(bgr_images)
+    for indices in groups.values():
+        for start in range(0, len(indices), PHOTO_BATCH_SIZE):
+            chunk = indices[start:start + PHOTO_BATCH_SIZE]
+            batch = _cnn_detector([small_images[i][0] for i in chunk], 1, batch_size=len(chunk))
+            for i, detections in zip(chunk, batch):
+                small, scale = small_images[i]
+                face_locations = rects_to_locations([detection.rect for detection in detections], small.shape)
+                locations[i] = upscale_locations(face_locations, scale)
+    return locations
+
+def process_photo_batch(manifest_path):
+    """Register every student in a manifest, saving all encodings with bulk upserts"""
+    try:
+        students = read_photo_manifest(manifest_path)
+    except Exception as e:
+        print(f"Error reading manifest: {e}")
+        return False
+    
+    print(f"Processing {len(students)} photos from {manifest_path}")
+    
+    # Connect and load the other students' faces while the photos are processed
+    with RegisteredFacesPrefetch(exclude_ids={student[0] for student in students}) as prefetch:
+        # Load every photo first so detection can run over whole batches
+        loaded = []
+        for student_id, name, email, photo_path in students:
+            image = load_photo(photo_path)
+            if image is None:
+                print(f"❌ {name} ({student_id}): could not load image from {photo_path}")
+                continue
+            loaded.append((student_id, name, email, image))
         
-        if len(face_encodings) == 0:
-            print("Error: Could not extract face encoding")
+        try:
+            all_locations = batch_face_locations([image for _, _, _, image in loaded])
+        except Exception as e:
+            print(f"Error detecting faces: {e}")
             return False
         
-        face_encoding = face_encodings[0]
-        
-        # Convert to string for database storage
-        encoding_str = ','.join([str(x) for x in face_encoding])
+        encoded = []
+        for (student_id, name, email, image), face_locations in zip(loaded, all_locations):
+            if len(face_locations) == 0:
+                print(f"❌ {name} ({student_id}): no face found in the image")
+                continue
+            
+            if len(face_locations) > 1:
+                print(f"⚠️ {name} ({student_id}): multiple faces found, using the first one")
+            
+            face_encodings = encode_face_crops(image, face_locations[:1])
+            if len(face_encodings) == 0:
+                print(f"❌ {name} ({student_id}): could not extract face encoding")
+                continue
+            
+            encoded.append((student_id, name, email, face_encodings[0]))
         
-        # Update database with face encoding
-        connection = connect_to_database()
-        if not connection:
+        if not encoded:
             return False
         
         try:
-            cursor = connection.cursor()
+            connection, registered_faces = prefetch.result()
+            if not connection:
+                return False
+            
+            # Check every new face against the students outside this batch at once
+            new_encodings = [encoding for _, _, _, encoding in encoded]
+            duplicates = find_duplicate_faces(registered_faces, new_encodings)
             
-            # Update the student record with face encoding
-            update_query = """
-                UPDATE students 
-                SET face_encoding = %s 
-                WHERE student_id = %s
-            """
-            cursor.execute(update_query, (encoding_str, student_id))
+            # The gallery excludes this manifest, so also compare its rows with each other;
+            # a row matching an earlier accepted row of another student is rejected
+            batch_sq_dists = pairwise_sq_distances(new_encodings)
+            accepted = []
+            
+            rows = []
+            for i, ((student_id, name, email, encoding), duplicate) in enumerate(zip(encoded, duplicates)):
+                if duplicate:
+                    print(f"❌ {name} ({student_id}): face already registered to {duplicate[1]} ({duplicate[0]})")
+                    continue
+                
+                twin = next((
+                    j for j in accepted
+                    if encoded[j][0] != student_id and batch_sq_dists[i, j] < DUPLICATE_TOLERANCE ** 2
+                ), None)
+                if twin is not None:
+                    print(f"❌ {name} ({student_id}): same face as {encoded[twin][1]} ({encoded[twin][0]}) in this manifest")
+                    continue
+                
+                accepted.append(i)
+                rows.append((student_id, name, email, encoding_to_blob(encoding)))
+            
+            if not rows:
+                return False
+            
+            # Plain cursor: executemany sends each chunk as a single multi-row INSERT,
+            # where a prepared cursor would make one round trip per row
+            cursor = connection.cursor()
+            for start in range(0, len(rows), BULK_STATEMENT_SIZE):
+                cursor.executemany(BULK_UPSERT_SQL, rows[start:start + BULK_STATEMENT_SIZE])
             connection.commit()
+            cursor.close()
             
-            print(f"✅ Face encoding saved for {student_name}")
-            return True
+            print(f"✅ Face encodings saved for {len(rows)} of {len(students)} students")
+            return len(rows) == len(students)
             
         except Exception as e:
             print(f"Error updating database: {e}")
             return False
-        finally:
-            connection.close()
-            
-    except Exception as e:
-        print(f"Error processing photo: {e}")
-        return False
 
 def capture_student_image(student_id, student_name):
-    """Capture and process student image for face recognition"""
+    """Capture a student image from the camera; returns the BGR frame or None"""
     print(f"Capturing image for {student_name} ({student_id})")
     print("Press SPACE to capture image, ESC to cancel")
     
     # Initialize camera
     cap = cv2.VideoCapture(0)
     
-    if not cap.isOpened():
-        print("Error: Could not open camera")
-        return None
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    try:
+        if not cap.isOpened():
+            print("Error: Could not open camera")
+            return None
         
-        # Display the frame
-        cv2.imshow('Capture Student Image', frame)
+        # MJPG keeps 720p within USB bandwidth; a one-frame buffer means SPACE
+        # captures the newest frame instead of one queued in the driver
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord(' '):  # Space to capture
-            # Save the captured image
-            image_path = f"temp_student_{student_id}.jpg"
-            cv2.imwrite(image_path, frame)
-            cap.release()
-            cv2.destroyAllWindows()
-            return image_path
-        elif key == 27:  # ESC to cancel
-            cap.release()
-            cv2.destroyAllWindows()
-            return None
-    
-    cap.release()
-    cv2.destroyAllWindows()
-    return None
+        # Discard the driver's preroll frames
+        for _ in range(5):
+            cap.grab()
+        
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return None
+            
+            # Display the frame
+            cv2.imshow('Capture Student Image', frame)
+            
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord(' '):  # Space to capture
+                # Keep the captured frame in memory
+                return frame
+            elif key == 27:  # ESC to cancel
+                return None
+    finally:
+        # Always free the camera, even on Ctrl-C
+        cap.release()
+        cv2.destroyAllWindows()
 
 def process_face_encoding(image_path):
     """Process image and extract face encoding"""
     try:
         # Load image
-        image = face_recognition.load_image_file(image_path)
-        
-        # Find face encodings
-        face_encodings = face_recognition.face_encodings(image)
+        image = load_photo(image_path)
+        if image is None:
+            print(f"Could not load image from {image_path}")
+            return None
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None
+    
+    return process_face_encoding_from_array(image)
+
+def process_face_encoding_from_array(image):
+    """Extract the face encoding from a BGR image already in memory"""
+    try:
+        # Find faces on a downscaled copy, then encode only the first one from the
+        # full image; the encoder gets the boxes, so it never re-runs detection
+        face_locations = detect_faces(image)
         
-        if len(face_encodings) == 0:
+        if len(face_locations) == 0:
             print("No face found in the image!")
             return None
         
-        if len(face_encodings) > 1:
+        if len(face_locations) > 1:
             print("Multiple faces found. Using the first one.")
         
+        face_encodings = encode_face_crops(image, face_locations[:1])
+        if len(face_encodings) == 0:
+            print("Could not extract face encoding!")
+            return None
+        
         # Return the first face encoding
         return face_encodings[0]
     
@@ -163,8 +517,14 @@ def add_student_to_database(student_id, name, email, face_encoding):
     try:
         cursor = connection.cursor()
         
-        # Convert face encoding to string
-        encoding_str = ','.join(map(str, face_encoding))
+        registered_faces = load_registered_faces(connection, exclude_ids=(student_id,))
+        duplicate = find_duplicate_faces(registered_faces, [face_encoding])[0]
+        if duplicate:
+            print(f"Face already registered to {duplicate[1]} ({duplicate[0]}), distance {duplicate[2]:.2f}")
+            return False
+        
+        # Convert face encoding to a compact int8 blob
+        encoding_blob = encoding_to_blob(face_encoding)
         
         # Insert student data
         query = """
@@ -176,7 +536,7 @@ def add_student_to_database(student_id, name, email, face_encoding):
         face_encoding = VALUES(face_encoding)
         """
         
-        cursor.execute(query, (student_id, name, email, encoding_str))
+        cursor.execute(query, (student_id, name, email, encoding_blob))
         connection.commit()
         
         print(f"Student {name} ({student_id}) successfully added to database!")
@@ -211,27 +571,20 @@ def register_student_interactive():
         return
     
     # Capture image
-    image_path = capture_student_image(student_id, name)
-    if not image_path:
+    frame = capture_student_image(student_id, name)
+    if frame is None:
         print("Image capture cancelled or failed!")
         return
     
-    # Process face encoding
-    face_encoding = process_face_encoding(image_path)
+    # Process face encoding straight from the captured frame
+    face_encoding = process_face_encoding_from_array(frame)
     if face_encoding is None:
         print("Failed to process face from image!")
-        # Clean up temp file
-        if os.path.exists(image_path):
-            os.remove(image_path)
         return
     
     # Add to database
     success = add_student_to_database(student_id, name, email, face_encoding)
     
-    # Clean up temp file
-    if os.path.exists(image_path):
-        os.remove(image_path)
-    
     if success:
         print("Student registration completed successfully!")
     else:
@@ -274,9 +627,49 @@ def register_from_file(image_file_path):
     else:
         print("Failed to register student!")
 
+def serve():
+    """Long-running worker mode for the web dashboard.
+    
+    Reads one JSON job per line from stdin ({"job_id", "student_id", "name",
+    "email", "photo_path"}) and writes {"job_id", "success"} per line to stdout.
+    Models and the connection pool stay loaded between registrations; progress
+    messages go to stderr so stdout only carries results.
+    """
+    results = sys.stdout
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        job = {}
+        try:
+            job = json.loads(line)
+            with redirect_stdout(sys.stderr):
+                success = process_photo_file(job['photo_path'], job['student_id'], job['name'], job['email'])
+            result = {"success": success}
+        except (ValueError, KeyError, TypeError) as e:
+            # job keeps whatever was parsed, so the reply still carries its job_id
+            result = {"success": False, "error": f"Invalid job: {e}"}
+        
+        result["job_id"] = job.get("job_id") if isinstance(job, dict) else None
+        results.write(json.dumps(result) + "\n")
+        results.flush()
+
 def main():
     """Main function"""
-    if len(sys.argv) == 5:
+    if len(sys.argv) == 2 and sys.argv[1] == '--serve':
+        with redirect_stdout(sys.stderr):
+            check_dlib_build()
+        serve()
+        return
+    
+    check_dlib_build()
+    
+    if len(sys.argv) == 3 and sys.argv[1] == '--batch':
+        # Bulk registration: python register_student.py --batch manifest.csv
+        sys.exit(0 if process_photo_batch(sys.argv[2]) else 1)
+    
+    elif len(sys.argv) == 5:
         # Called from web dashboard: python register_student.py student_id name email photo_path
         student_id = sys.argv[1]
         student_name = sys.argv[2]
@@ -0,0 +1,35 @@
+#!/usr/bin/env bash
+# Build dlib from source with AVX/SSE4 SIMD and BLAS enabled.
+# The prebuilt/pip dlib is compiled without AVX, which makes HOG detection
+# and the 128-d face encoder several times slower.
+#
+# Usage: ./setup_dlib.sh            (run inside the Python environment)
+#        USE_CUDA=1 ./setup_dlib.sh (also build the CUDA face encoder/CNN detector;
+#                                    needs the CUDA toolkit and cuDNN)
+
+set -e
+
+DLIB_VERSION="${DLIB_VERSION:-19.24.2}"
+USE_CUDA="${USE_CUDA:-0}"
+BUILD_DIR="${BUILD_DIR:-/tmp/dlib-build}"
+
+rm -rf "$BUILD_DIR"
+git clone --depth 1 --branch "v$DLIB_VERSION" https://github.com/davisking/dlib.git "$BUILD_DIR"
+cd "$BUILD_DIR"
+
+if [ "$USE_CUDA" = "1" ]; then
+    CUDA_FLAG="--set DLIB_USE_CUDA=1"
+else
+    CUDA_FLAG="--no DLIB_USE_CUDA"
+fi
+
+python setup.py install \
+    --set USE_AVX_INSTRUCTIONS=1 \
+    --set USE_SSE4_INSTRUCTIONS=1 \
+    --set DLIB_USE_BLAS=1 \
+    $CUDA_FLAG
+
+cd /
+rm -rf "$BUILD_DIR"
+
+python -c "import dlib; print('dlib', dlib.__version__, 'AVX:', getattr(dlib, 'USE_AVX_INSTRUCTIONS', False), 'CUDA:', dlib.DLIB_USE_CUDA)"